@@ -1,12 +1,25 @@
+import ctypes
 import os
 import warnings
 import joblib
 import numpy as np
 import pandas as pd
-from typing import Union, List, Optional
-from lightgbm import LGBMRegressor
-from skforecast.ForecasterAutoregMultiSeries import ForecasterAutoregMultiSeries
+from functools import lru_cache, partial
+from typing import Union, List, Optional, Tuple
+from joblib import cpu_count, effective_n_jobs
+from lightgbm import Booster, LGBMRegressor
+from lightgbm.basic import (
+    _C_API_DTYPE_FLOAT64,
+    _C_API_PREDICT_NORMAL,
+    _LIB,
+    _c_str,
+    _safe_call,
+)
+from skforecast.ForecasterAutoregMultiSeries import (
+    ForecasterAutoregMultiSeries as SkforecastMultiSeries,
+)
 from schema.data_schema import ForecastingSchema
+from sklearn.base import clone
 from sklearn.exceptions import NotFittedError
 from sklearn.preprocessing import MinMaxScaler
 
@@ -19,6 +32,127 @@ PREDICTOR_FILE_NAME = "predictor.joblib"
 
 PREDICTOR_FILE_NAME = "predictor.joblib"
 
+# Smallest number of series per LightGBM thread at prediction time
+MIN_SERIES_PER_THREAD = 100
+
+
+# ragged histories yield one template per series length, so only the most
+# recently used ones are kept
+@lru_cache(maxsize=8)
+def _lag_index(n_obs: int, lags: Tuple[int, ...]) -> np.ndarray:
+    """
+    Positions of the lagged values of a series of the given length.
+
+    Args:
+        n_obs (int): Length of the series.
+        lags (Tuple[int, ...]): Lags used as predictors.
+
+    Returns (np.ndarray): Array of shape (n_obs - max(lags), len(lags)) whose row i
+        holds the positions of the lags of observation max(lags) + i.
+    """
+    max_lag = max(lags)
+    return np.arange(n_obs - max_lag)[:, None] + (max_lag - np.array(lags))
+
+
+def _align_series(
+    values: np.ndarray, offsets: np.ndarray, lengths: np.ndarray
+) -> np.ndarray:
+    """
+    Stacks the trailing observations of series stored contiguously, aligning
+    them on their last observation.
+
+    Args:
+        values (np.ndarray): Values of all the series, one series after the other.
+        offsets (np.ndarray): Start position of each series in `values`, followed by the total length.
+        lengths (np.ndarray): Number of trailing observations to keep for each series.
+
+    Returns (np.ndarray): Array of shape (max(lengths), n_series, *values.shape[1:]),
+        padded with NaN at the start of the shorter series.
+    """
+    n_rows = lengths.max()
+    aligned = np.full((n_rows, len(lengths)) + values.shape[1:], np.nan)
+    for i, (end, length) in enumerate(zip(offsets[1:], lengths)):
+        aligned[n_rows - length :, i] = values[end - length : end]
+    return aligned
+
+
+class SingleRowPredictor:
+    """Predicts one row at a time through LightGBM's single row fast path
+    (LGBM_BoosterPredictForMatSingleRowFast), which parses the prediction
+    configuration once instead of on every call.
+
+    The prediction configuration is a C handle, so instances cannot be pickled
+    and must be created in the process that uses them.
+    """
+
+    def __init__(self, booster: Booster, n_features: int):
+        """
+        Args:
+            booster (Booster): Trained LightGBM booster.
+            n_features (int): Number of features of the rows to predict.
+        """
+        self._config = ctypes.c_void_p()
+        _safe_call(
+            _LIB.LGBM_BoosterPredictForMatSingleRowFastInit(
+                booster._handle,
+                ctypes.c_int(_C_API_PREDICT_NORMAL),
+                ctypes.c_int(0),
+                ctypes.c_int(-1),
+                ctypes.c_int(_C_API_DTYPE_FLOAT64),
+                ctypes.c_int32(n_features),
+                _c_str("num_threads=1"),
+                ctypes.byref(self._config),
+            )
+        )
+        self._out_len = ctypes.c_int64(0)
+        self._out = np.empty(1, dtype=np.float64)
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            X (np.ndarray): C-contiguous float64 array of shape (1, n_features).
+
+        Returns (np.ndarray): The prediction, as an array of shape (1,) that is
+            overwritten by the next call.
+        """
+        _safe_call(
+            _LIB.LGBM_BoosterPredictForMatSingleRowFast(
+                self._config,
+                X.ctypes.data_as(ctypes.c_void_p),
+                ctypes.byref(self._out_len),
+                self._out.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+            )
+        )
+        return self._out
+
+    def __del__(self):
+        if self._config:
+            _LIB.LGBM_FastConfigFree(self._config)
+
+
+class ForecasterAutoregMultiSeries(SkforecastMultiSeries):
+    """skforecast's ForecasterAutoregMultiSeries building the lag matrix of each
+    series with a single fancy-indexing operation. The index template is shared
+    by all the series of the same length, which is the common case once the
+    histories are cropped.
+
+    The class name is kept since skforecast validates inputs based on it.
+    """
+
+    def _create_lags(
+        self, y: np.ndarray, series_name: str
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if len(y) - self.max_lag <= 0:
+            raise ValueError(
+                f"The maximum lag ({self.max_lag}) must be less than the length "
+                f"of the series '{series_name}', ({len(y)})."
+            )
+        X_data = y[_lag_index(len(y), tuple(self.lags.tolist()))].astype(
+            float, copy=False
+        )
+        y_data = y[self.max_lag :]
+        return X_data, y_data
+
 
 class Forecaster:
     """A wrapper class for the LGBM Forecaster.
@@ -43,6 +177,7 @@ class Forecaster:
         use_exogenous: bool = True,
         verbose: int = 1,
         random_state: int = 0,
+        n_jobs: Optional[int] = None,
         **kwargs,
     ):
         """Construct a new LGBM Forecaster
@@ -88,6 +223,11 @@ class Forecaster:
 
             random_state (int): Sets the underlying random seed at model initialization time.
 
+            n_jobs (Optional[int]): Number of parallel threads used by LightGBM to build the trees
+                and, when there are enough series, to predict them at each forecast step.
+                Negative values follow joblib's convention, so -1 uses all logical CPUs.
+                None keeps LightGBM's default of using the physical cores.
+
             kwargs (dict): Additional parameters accepted by the base model.
         """
         self.n_estimators = n_estimators
@@ -98,6 +238,7 @@ class Forecaster:
         self.random_state = random_state
         self.use_exogenous = use_exogenous
         self.verbose = verbose
+        self.n_jobs = n_jobs
         self.lags = lags
         self._is_trained = False
         self.models = {}
@@ -126,10 +267,11 @@ class Forecaster:
             max_depth=self.max_depth,
             random_state=self.random_state,
             verbose=self.verbose,
+            n_jobs=self.n_jobs,
             **kwargs,
         )
 
-        self.transformer_exog = MinMaxScaler() if has_covariates else None
+        self.transformer_exog = MinMaxScaler() if self.use_exogenous else None
 
     def _add_future_covariates_from_date(
         self,
@@ -140,6 +282,10 @@ class Forecaster:
         """
         Creates future covariates from the data column.
 
+        On training data, the names of the created columns are stored in
+        `_date_covariates_names`, which `fit` reads right after this call.
+        On prediction data, nothing is done if the columns already exist.
+
         Args:
             history (pd.DataFrame):
                 The data to create the covariates on.
@@ -153,37 +299,24 @@ class Forecaster:
         Returns (pd.DataFrame): The processed dataframe
         """
 
-        future_covariates_names = data_schema.future_covariates
-        if data_schema.time_col_dtype in ["DATE", "DATETIME"]:
-            date_col = pd.to_datetime(history[data_schema.time_col])
-            year_col = date_col.dt.year
-            month_col = date_col.dt.month
-            year_col_name = f"{data_schema.time_col}_year"
-            month_col_name = f"{data_schema.time_col}_month"
-            history[year_col_name] = year_col
-            history[month_col_name] = month_col
-            if is_training:
-                future_covariates_names += [year_col_name, month_col_name]
-
-        return history
-
-    def crop_data(self, all_series: List[pd.DataFrame]) -> List[pd.DataFrame]:
-        """
-        Reduces the data based on the history_length attribute.
-
-        Args:
-            all_series (List[pd.DataFrame]): List of the original data to be reduced.
+        if data_schema.time_col_dtype not in ["DATE", "DATETIME"]:
+            return history
 
-        Returns (List[pd.DataFrame]): List of the reduced data.
+        year_col_name = f"{data_schema.time_col}_year"
+        month_col_name = f"{data_schema.time_col}_month"
+        if is_training:
+            self._date_covariates_names = [year_col_name, month_col_name]
+        elif year_col_name in history and month_col_name in history:
+            return history
 
-        """
+        date_col = history[data_schema.time_col]
+        if not pd.api.types.is_datetime64_any_dtype(date_col):
+            date_col = pd.to_datetime(date_col)
+        date_col = date_col.dt
+        history[year_col_name] = date_col.year.values.astype(np.int16)
+        history[month_col_name] = date_col.month.values.astype(np.int8)
 
-        new_length = []
-        for series in all_series:
-            series = series.iloc[-self.history_length :]
-            new_length.append(series.copy())
-        all_series = new_length
-        return all_series
+        return history
 
     def _validate_lags_and_history_length(self, series_length: int):
         """
@@ -219,49 +352,132 @@ class Forecaster:
         """
         np.random.seed(self.random_state)
         data_schema = self.data_schema
-        history = self._add_future_covariates_from_date(
-            history=history, data_schema=data_schema, is_training=True
+        self._date_covariates_names = []
+        if self.use_exogenous:
+            history = self._add_future_covariates_from_date(
+                history=history, data_schema=data_schema, is_training=True
+            )
+        self._future_covariates = (
+            data_schema.future_covariates + self._date_covariates_names
         )
-        groups_by_ids = history.groupby(data_schema.id_col)
-        all_ids = list(groups_by_ids.groups.keys())
-        all_series = [
-            groups_by_ids.get_group(id_).drop(columns=data_schema.id_col).reset_index()
-            for id_ in all_ids
-        ]
-
+        # Rows are gathered series by series into contiguous arrays, the
+        # i-th series spanning positions offsets[i] to offsets[i + 1].
+        # ids are sorted so the model's features do not depend on the row order
+        codes, all_ids = pd.factorize(history[data_schema.id_col], sort=True)
+        order = np.argsort(codes, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(codes))))
+        lengths = np.diff(offsets)
+        full_length = lengths.max()
         if self.history_length:
-            all_series = self.crop_data(all_series)
-
-        targets = [series[data_schema.target] for series in all_series]
-        target_series = pd.DataFrame({f"id_{k}": v for k, v in zip(all_ids, targets)})
+            lengths = np.minimum(lengths, self.history_length)
 
-        self._validate_lags_and_history_length(series_length=len(targets[0]))
+        self._validate_lags_and_history_length(series_length=lengths.min())
 
-        target_series.columns = [f"id_{i}" for i in range(len(target_series.columns))]
+        index = pd.RangeIndex(start=full_length - lengths.max(), stop=full_length)
+        target = history[data_schema.target].to_numpy(dtype=float)[order]
+        target_series = pd.DataFrame(
+            _align_series(target, offsets, lengths),
+            index=index,
+            columns=[f"id_{i}" for i in range(len(all_ids))],
+        )
 
         exog = None
 
         if self.use_exogenous:
-            covariates_names = (
-                data_schema.future_covariates + data_schema.static_covariates
+            covariates_names = self._future_covariates + data_schema.static_covariates
+            covariates = history[covariates_names].to_numpy(dtype=float)[order]
+            covariates = _align_series(covariates, offsets, lengths)
+            exog = pd.DataFrame(
+                covariates.reshape(len(index), -1),
+                index=index,
             )
-            exog = [series[covariates_names] for series in all_series]
-            exog = pd.concat(exog, axis=1)
             exog.columns = [str(i) for i in range(exog.shape[1])]
-            self.train_end_index = all_series[0].index.values[-1]
 
+        # base_model stays an unfitted template, configured once in __init__
         self.model = ForecasterAutoregMultiSeries(
-            regressor=self.base_model,
+            regressor=clone(self.base_model),
             lags=self.lags,
             transformer_series=MinMaxScaler(),
             transformer_exog=self.transformer_exog,
         )
 
-        self.model.fit(series=target_series, exog=exog)
+        # in-sample residuals only serve skforecast's prediction intervals
+        self.model.fit(series=target_series, exog=exog, store_in_sample_residuals=False)
 
-        self.all_ids = all_ids
+        self.all_ids = all_ids.tolist()
         self._is_trained = True
 
+    def _recursive_predict(
+        self, levels: List[str], exog: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Forecasts the given series recursively, predicting the next step of
+        all of them with a single call to the regressor.
+
+        This follows ForecasterAutoregMultiSeries.predict, which instead calls
+        the regressor once per series and step.
+
+        Args:
+            levels (List[str]): Names of the series (as seen by the skforecast model) to forecast.
+            exog (Optional[np.ndarray]): Transformed exogenous variables of the forecast horizon.
+
+        Returns (np.ndarray): The forecasts with shape (forecast_length, len(levels)).
+        """
+        model = self.model
+        steps = self.data_schema.forecast_length
+        n_lags = len(model.lags)
+        n_exog = 0 if exog is None else exog.shape[1]
+        scalers = [model.transformer_series_[level] for level in levels]
+        scale = np.array([scaler.scale_[0] for scaler in scalers])
+        offset = np.array([scaler.min_[0] for scaler in scalers])
+
+        # rows are series, columns are the most recent values in scaled space
+        window = model.last_window[levels].to_numpy().T * scale[:, None]
+        window += offset[:, None]
+        lag_positions = model.window_size - model.lags
+
+        # The one-hot series columns were trained in pd.get_dummies' lexicographic
+        # order (id_0, id_1, id_10, ...), so each series' column is looked up by
+        # name. skforecast's own predict indexes them in series order instead.
+        X = np.zeros((len(levels), len(model.X_train_col_names)))
+        columns = {name: i for i, name in enumerate(model.X_train_col_names)}
+        X[np.arange(len(levels)), [columns[level] for level in levels]] = 1.0
+
+        # The booster is called directly since the scikit-learn wrapper's input
+        # checks cost several times the prediction itself on so few rows.
+        booster = model.regressor.booster_
+        if len(levels) == 1:
+            predict = SingleRowPredictor(booster, n_features=X.shape[1]).predict
+        else:
+            # LightGBM splits the rows of each step across its threads, which
+            # only pays off with enough series per thread. joblib resolves None
+            # to a single job, so it is taken as the physical cores available to
+            # the process instead, as LightGBM does when training.
+            n_jobs = (
+                cpu_count(only_physical_cores=True)
+                if self.n_jobs is None
+                else self.n_jobs
+            )
+            n_threads = min(
+                effective_n_jobs(n_jobs),
+                int(np.ceil(len(levels) / MIN_SERIES_PER_THREAD)),
+            )
+            predict = partial(booster.predict, num_threads=n_threads)
+
+        forecast = np.empty((steps, len(levels)))
+        for step in range(steps):
+            X[:, :n_lags] = window[:, lag_positions]
+            if exog is not None:
+                X[:, n_lags : n_lags + n_exog] = exog[step]
+            prediction = predict(X)
+            forecast[step] = prediction
+            window[:, :-1] = window[:, 1:]
+            window[:, -1] = prediction
+
+        forecast -= offset
+        forecast /= scale
+        return forecast
+
     def predict(self, test_data: pd.DataFrame, prediction_col_name: str) -> np.ndarray:
         """Make the forecast of given length.
 
@@ -274,37 +490,35 @@ class Forecaster:
         if not self._is_trained:
             raise NotFittedError("Model is not fitted yet.")
 
-        test_data = self._add_future_covariates_from_date(
-            history=test_data, data_schema=self.data_schema, is_training=False
-        )
+        if self.use_exogenous:
+            test_data = self._add_future_covariates_from_date(
+                history=test_data, data_schema=self.data_schema, is_training=False
+            )
 
-        groups_by_ids = test_data.groupby(self.data_schema.id_col)
-        all_series = [
-            groups_by_ids.get_group(id_)
-            .drop(columns=self.data_schema.id_col)
-            .reset_index()
-            for id_ in self.all_ids
-        ]
-        exog = None
+        positions = test_data.groupby(self.data_schema.id_col, sort=False).indices
+        rows = np.concatenate([positions[id_] for id_ in self.all_ids])
+        exog_values = None
         if self.use_exogenous:
             covariates_names = (
-                self.data_schema.future_covariates + self.data_schema.static_covariates
+                self._future_covariates + self.data_schema.static_covariates
             )
-            exog = [series[covariates_names] for series in all_series]
-            exog = pd.concat(exog, axis=1)
-            exog.columns = [str(i) for i in range(exog.shape[1])]
-            start = self.train_end_index + 1
-            exog.index = pd.RangeIndex(
-                start=start,
-                stop=start + self.data_schema.forecast_length,
+            # one row per step holding the covariates of every series in turn,
+            # as laid out when the exog was fitted
+            covariates = test_data[covariates_names].to_numpy(dtype=float)[rows]
+            covariates = covariates.reshape(
+                len(self.all_ids), -1, len(covariates_names)
             )
+            covariates = covariates.transpose(1, 0, 2).reshape(covariates.shape[1], -1)
+            exog_values = self.model.transformer_exog.transform(covariates)
 
-        forecast = self.model.predict(steps=self.data_schema.forecast_length, exog=exog)
-        forecast.columns = [c.split("id_")[1] for c in forecast.columns]
-        predictions = []
-        for column in forecast.columns:
-            predictions += forecast[column].values.tolist()
+        forecast = self._recursive_predict(
+            levels=self.model.series_col_names, exog=exog_values
+        )
 
+        # forecasts are written at the positions of their rows since test rows
+        # need not follow the order in which the series were seen during training
+        predictions = np.full(len(test_data), np.nan)
+        predictions[rows] = forecast.ravel(order="F")
         test_data[prediction_col_name] = predictions
 
         return test_data
@@ -317,7 +531,12 @@ class Forecaster:
         """
         if not self._is_trained:
             raise NotFittedError("Model is not fitted yet.")
-        joblib.dump(self, os.path.join(model_dir_path, PREDICTOR_FILE_NAME))
+        joblib.dump(
+            self,
+            os.path.join(model_dir_path, PREDICTOR_FILE_NAME),
+            compress=3,
+            protocol=5,
+        )
 
     @classmethod
     def load(cls, model_dir_path: str) -> "Forecaster":